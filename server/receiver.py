@@ -11,26 +11,48 @@ Endpoints:
   POST /stack  — save a timelapse stack JPEG into a dated directory
 
 Usage:
-  pip install flask pyyaml requests geopy
+  pip install flask gunicorn orjson pyyaml requests geopy
   python3 receiver.py [--config config.yaml]
+
+main() re-executes the same interpreter as `python -m gunicorn` (gthread
+workers, preloaded app).  The
+equivalent manual invocation is:
+  RECEIVER_CONFIG=config.yaml gunicorn -k gthread --threads 5 \
+      --workers $WEB_CONCURRENCY --preload -b 0.0.0.0:8765 \
+      'receiver:make_app_from_env()'
 """
 
 import argparse
+import atexit
+import calendar
+import copy
+import errno
+import fcntl
 import io
 import json
 import logging
+import logging.handlers
+import mmap
 import os
+import queue
+import re
+import shlex
+import shutil
 import subprocess
+import sys
 import threading
 import time
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
+from types import MappingProxyType
 
 import numpy as np
+import orjson
 import requests
 import yaml
-from flask import Flask, jsonify, request
+from flask import Flask, Response, request
 from geopy.geocoders import Nominatim
 from PIL import Image, ImageFilter
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -51,16 +73,39 @@ DEFAULT_CONFIG = {
     "save_raw_stack": True,   # save a copy of the unedited STACK JPEG
     "address": None,          # optional address to lookup flights relative to
     "opensky_radius_km": 16,  # search radius (~10 miles)
+    "direct_io": False,       # write FF files with O_DIRECT (bypass page cache)
+    "durable_writes": False,  # fdatasync each FF/stack file (+ its dir) before replying
+    "drop_cache_after_write": False,  # evict written FF files from the page cache
+    "max_upload_bytes": 64 * 1024 * 1024,  # reject larger /ff and /stack bodies (413)
 }
 
 
+# Parsed config.yaml contents keyed by path: (st_mtime_ns, st_size, overrides).
+_CFG_CACHE: dict = {}
+
+
+def _read_overrides(path: str) -> dict:
+    """
+    Parse a config file, reusing the previous result while its mtime and size
+    are unchanged.  Callers get a deep copy so they may mutate it freely.
+    """
+    st = os.stat(path)
+    hit = _CFG_CACHE.get(path)
+    if hit is not None and hit[:2] == (st.st_mtime_ns, st.st_size):
+        return copy.deepcopy(hit[2])
+    with open(path, "r", encoding="utf-8") as fh:
+        # libyaml-backed loader when available; same semantics as safe_load.
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        overrides = yaml.load(fh, Loader=loader) or {}  # noqa: S506
+    _CFG_CACHE[path] = (st.st_mtime_ns, st.st_size, overrides)
+    return copy.deepcopy(overrides)
+
+
 def load_config(path: str) -> dict:
     """Load config"""
     cfg = dict(DEFAULT_CONFIG)
     if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as fh:
-            overrides = yaml.safe_load(fh) or {}
-        cfg.update(overrides)
+        cfg.update(_read_overrides(path))
     # Expand ~ in path values that may come from config.yaml as raw strings.
     cfg["rms_data_dir"] = os.path.expanduser(cfg["rms_data_dir"])
     return cfg
@@ -70,18 +115,48 @@ def load_config(path: str) -> dict:
 # Night-directory helpers
 # ---------------------------------------------------------------------------
 
+NIGHT_DIR_FMT = "%Y%m%d_%H%M%S_000000"
+
+
 def night_dir_name(dt: datetime) -> str:
     """
     Return an RMS-style night directory name for a given UTC datetime.
     Nights start at 12:00 UTC and end the following day at 11:59 UTC,
     so a recording at 02:00 on the 16th belongs to the night starting on the 15th.
+
+    >>> for ts in (1705406399, 1705406400):  # 2024-01-16 11:59:59 / 12:00:00 UTC
+    ...     dt = datetime.fromtimestamp(ts, tz=timezone.utc)
+    ...     print(night_dir_name(dt), night_dir_name_fast(ts))
+    20240115_120000_000000 20240115_120000_000000
+    20240116_120000_000000 20240116_120000_000000
+    >>> night_dir_name(datetime(2024, 1, 16, 2, 0))   # naive datetimes are UTC
+    '20240115_120000_000000'
     """
-    if dt.hour < 12:
-        night_start = dt.replace(hour=12, minute=0, second=0,
-                                 microsecond=0) - timedelta(days=1)
-    else:
-        night_start = dt.replace(hour=12, minute=0, second=0, microsecond=0)
-    return night_start.strftime("%Y%m%d_%H%M%S_000000")
+    return night_dir_name_fast(calendar.timegm(dt.utctimetuple()))
+
+
+def night_start_epoch(epoch: int) -> int:
+    """Unix timestamp of the 12:00 UTC start of the night containing epoch."""
+    shifted = epoch - 12 * 3600
+    return shifted - shifted % 86400 + 12 * 3600
+
+
+def night_dir_name_fast(epoch: int) -> str:
+    """night_dir_name() for a Unix timestamp, used on the request path."""
+    return time.strftime(NIGHT_DIR_FMT, time.gmtime(night_start_epoch(epoch)))
+
+
+# Night directories for stations seen tonight are created this many seconds
+# before the 12:00 UTC rollover, keeping makedirs off the request path.
+PRECREATE_LEAD_S = 60
+
+RMS_TRIGGER_WORKERS = 2   # concurrent RMS runs per process (per gunicorn worker)
+RMS_LOCK_NAME = ".rms.lock"   # flock'd in the night dir while RMS runs on it
+
+# Accepted X-Filename values: a single path component of safe characters that
+# cannot start with '.', so traversal, separators, NUL and drive letters are
+# all rejected by one match in C.
+_SAFE_FILENAME = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9._-]{0,127}\Z").match
 
 
 def station_from_filename(filename: str) -> str:
@@ -102,6 +177,275 @@ def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
 
+def with_dir(path: str, make_dir, func, *args, **kwargs):
+    """
+    Return func(*args, **kwargs), which writes to path.  If path's directory has been
+    removed since it was cached (e.g. a night deleted in nightcam_review),
+    recreate it with make_dir(dirname) and try once more.
+    """
+    try:
+        return func(*args, **kwargs)
+    except FileNotFoundError:
+        make_dir(os.path.dirname(path))
+        return func(*args, **kwargs)
+
+
+def sync_dir(path: str) -> None:
+    """fsync a directory so entries just created in it survive a crash."""
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _discard(path: str) -> None:
+    """Remove a partially written file so RMS / the review tool never see it."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def write_file(path: str, data: bytes, durable: bool = False) -> None:
+    """Write data to path; with durable, fdatasync before returning."""
+    with open(path, "wb") as fh:
+        try:
+            fh.write(data)
+            if durable:
+                fh.flush()
+                os.fdatasync(fh.fileno())
+                sync_dir(os.path.dirname(path))
+        except BaseException:
+            _discard(path)
+            raise
+
+
+def copy_file(src: str, dst: str, durable: bool = False) -> None:
+    """shutil.copyfile (sendfile on Linux); with durable, fdatasync dst."""
+    try:
+        shutil.copyfile(src, dst)
+        if durable:
+            fd = os.open(dst, os.O_RDONLY)
+            try:
+                os.fdatasync(fd)
+            finally:
+                os.close(fd)
+            sync_dir(os.path.dirname(dst))
+    except BaseException:
+        _discard(dst)
+        raise
+
+
+# ---------------------------------------------------------------------------
+# Upload persistence
+# ---------------------------------------------------------------------------
+
+STREAM_CHUNK = 1024 * 1024   # bytes read from the request body per iteration
+WRITE_BATCH  = 4             # STREAM_CHUNKs gathered per write syscall
+WRITE_ALIGN  = 4096          # page / O_DIRECT block size; writes stay multiples of it
+WRITEV_IOVS  = 512           # cap on gathered chunks, well under Linux IOV_MAX (1024)
+
+
+def _read_into(stream, view: memoryview) -> int:
+    """Read the next piece of stream into view; returns the byte count, 0 at EOF."""
+    readinto = getattr(stream, "readinto", None)
+    if readinto is not None:
+        return readinto(view) or 0
+    chunk = stream.read(len(view))
+    view[:len(chunk)] = chunk
+    return len(chunk)
+
+
+def _check_limit(total: int, limit) -> None:
+    """Raise a 413 once more than limit bytes (None: no limit) have arrived."""
+    if limit is not None and total > limit:
+        raise RequestEntityTooLarge()
+
+
+def _write_all(fd: int, view: memoryview) -> None:
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _writev_all(fd: int, chunks: list) -> None:
+    done = os.writev(fd, chunks)
+    for chunk in chunks:
+        # Normally a no-op: finishes any chunk a short writev left behind.
+        if done >= len(chunk):
+            done -= len(chunk)
+            continue
+        _write_all(fd, memoryview(chunk)[done:])
+        done = 0
+
+
+def _preallocate(fd: int, size_hint) -> None:
+    """Reserve size_hint bytes up front so the file gets contiguous extents."""
+    if size_hint:
+        try:
+            os.posix_fallocate(fd, 0, size_hint)
+        except OSError as exc:
+            logging.debug("posix_fallocate(%d) failed: %s", size_hint, exc)
+
+
+def _finish_write(fd: int, size: int, size_hint, durable: bool,
+                  drop_cache: bool) -> None:
+    # A body shorter than its Content-Length leaves preallocated space past
+    # the data; trim the file back to what was actually received.
+    if size_hint and size < size_hint:
+        os.ftruncate(fd, size)
+    # Without durable the data sits in the page cache until normal writeback,
+    # so a crash or power loss within that window can lose a just-ACKed file.
+    # Syncing every upload costs far more than it saves on this workload.
+    # (The saver also fsyncs the parent directory so the new entry persists.)
+    # DONTNEED ignores dirty pages, so dropping the cache needs a sync first.
+    if durable or drop_cache:
+        os.fdatasync(fd)
+    if drop_cache:
+        os.posix_fadvise(fd, 0, size, os.POSIX_FADV_DONTNEED)
+
+
+def save_stream(stream, dest_path: str, durable: bool = False,
+                drop_cache: bool = False, size_hint=None, limit=None) -> int:
+    """
+    Copy a request body stream to dest_path so memory stays bounded regardless
+    of upload size.  Returns the number of bytes written.
+    size_hint, when known (Content-Length), is preallocated before writing.
+    A body longer than limit bytes raises RequestEntityTooLarge.
+    Data goes to the kernel WRITE_BATCH * STREAM_CHUNK bytes per syscall:
+    streams with readinto() fill one reusable buffer; plain read() streams
+    (gunicorn's raw request body, which the handlers pass straight through)
+    have their chunks gathered with writev() rather than copied into a buffer.  Every write except the last is a
+    WRITE_ALIGN multiple, so the page cache only ever sees whole pages.
+    If anything fails (e.g. the client disconnects mid-upload) the partial
+    file is removed before the exception propagates.
+    """
+    total = 0
+    fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _preallocate(fd, size_hint)
+        if getattr(stream, "readinto", None) is not None:
+            view = memoryview(bytearray(STREAM_CHUNK * WRITE_BATCH))
+            while True:
+                fill = 0
+                while fill < len(view):
+                    n = _read_into(stream, view[fill:])
+                    if not n:
+                        break
+                    fill += n
+                    _check_limit(total + fill, limit)
+                if fill:
+                    _write_all(fd, view[:fill])
+                    total += fill
+                if fill < len(view):
+                    break
+        else:
+            batch, size = [], 0
+            while True:
+                chunk = stream.read(STREAM_CHUNK)
+                if not chunk:
+                    if batch:
+                        _writev_all(fd, batch)
+                    break
+                batch.append(chunk)
+                size  += len(chunk)
+                total += len(chunk)
+                _check_limit(total, limit)
+                if size >= STREAM_CHUNK * WRITE_BATCH or len(batch) >= WRITEV_IOVS:
+                    # Short reads can leave the batch unaligned: hold back
+                    # the sub-page remainder for the next write.
+                    tail, carry = size % WRITE_ALIGN, []
+                    while tail:
+                        last = memoryview(batch.pop())
+                        if len(last) > tail:
+                            batch.append(last[:-tail])
+                            carry.insert(0, last[-tail:])
+                            tail = 0
+                        else:
+                            carry.insert(0, last)
+                            tail -= len(last)
+                    if batch:
+                        _writev_all(fd, batch)
+                    # Collapse the (< WRITE_ALIGN byte) carry into one buffer
+                    # so a run of tiny reads can't grow the batch past
+                    # WRITEV_IOVS while it waits for a full page.
+                    if len(carry) > 1:
+                        carry = [b"".join(carry)]
+                    batch, size = carry, sum(map(len, carry))
+        _finish_write(fd, total, size_hint, durable, drop_cache)
+        if durable:
+            sync_dir(os.path.dirname(dest_path))
+    except BaseException:
+        _discard(dest_path)
+        raise
+    finally:
+        os.close(fd)
+    return total
+
+
+DIRECT_BUF = 4 * 1024 * 1024   # aligned staging buffer size for O_DIRECT
+
+
+def save_stream_direct(stream, dest_path: str, durable: bool = False,
+                       drop_cache: bool = False, size_hint=None, limit=None) -> int:
+    """
+    Like save_stream() but opens dest_path with O_DIRECT so write-once FF
+    files do not fill the page cache.  Data is staged in a page-aligned
+    buffer and written in WRITE_ALIGN multiples; the final partial block is
+    zero-padded and the file truncated back to its exact size.  Falls back
+    to save_stream() on filesystems that reject O_DIRECT (e.g. tmpfs).
+    As with save_stream(), a failed upload leaves no file behind.
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_DIRECT", 0)
+    try:
+        fd = os.open(dest_path, flags, 0o644)
+    except OSError as exc:
+        if exc.errno != errno.EINVAL:
+            raise
+        logging.debug("O_DIRECT unsupported for %s, using buffered write", dest_path)
+        return save_stream(stream, dest_path, durable, drop_cache, size_hint, limit)
+
+    total = 0
+    # Anonymous mappings are page-aligned, which satisfies O_DIRECT.
+    buf = mmap.mmap(-1, DIRECT_BUF)
+    view = memoryview(buf)
+    try:
+        _preallocate(fd, size_hint)
+        fill = 0
+        while True:
+            n = _read_into(stream, view[fill:])
+            if not n:
+                break
+            fill  += n
+            total += n
+            _check_limit(total, limit)
+            if fill == DIRECT_BUF:
+                _write_all(fd, view)
+                fill = 0
+        if fill:
+            padded = -(-fill // WRITE_ALIGN) * WRITE_ALIGN
+            view[fill:padded] = bytes(padded - fill)
+            _write_all(fd, view[:padded])
+            os.ftruncate(fd, total)
+        _finish_write(fd, total, size_hint, durable, drop_cache=False)   # never cached
+        if durable:
+            sync_dir(os.path.dirname(dest_path))
+    except BaseException:
+        _discard(dest_path)
+        raise
+    finally:
+        os.close(fd)
+        view.release()
+        try:
+            buf.close()
+        except BufferError:
+            # A traceback still holds a slice of view (the stream or write
+            # failed); the map is unmapped once that is dropped.  Never let
+            # this mask the original exception.
+            pass
+    return total
+
+
 # ---------------------------------------------------------------------------
 # Stack JPEG enhancement
 # ---------------------------------------------------------------------------
@@ -154,10 +498,81 @@ def _enhance_stack(data: bytes, quality: int = 92) -> bytes:
 # Flask application factory
 # ---------------------------------------------------------------------------
 
+_log = logging.getLogger("receiver")
+
+# Shared read-only default for missing/invalid event fields (no per-call dict).
+_EMPTY = MappingProxyType({})
+
+# /event log formats
+_FMT_METEOR = "METEOR cam=%s ts_ms=%d rho=%s theta=%s votes=%s len=%s"
+_FMT_STACK  = ("STACK  cam=%s ts_ms=%d file=%s "
+               "ivs_polls=%s active=%s total_rois=%s last=%s")
+_FMT_EVENT  = "EVENT  cam=%s ts_ms=%d type=%s"
+
+
+def _log_meteor(evt, cam, ts_ms) -> None:
+    cand = evt.get("candidate", _EMPTY)
+    _log.info(_FMT_METEOR, cam, ts_ms,
+              cand.get("rho", "?"), cand.get("theta", "?"),
+              cand.get("votes", "?"), cand.get("length_px", "?"))
+
+
+def _log_stack(evt, cam, ts_ms) -> None:
+    _log.info(_FMT_STACK, cam, ts_ms,
+              evt.get("filename", "?"),
+              evt.get("ivs_polls", "?"),
+              evt.get("ivs_active_polls", "?"),
+              evt.get("ivs_total_rois", "?"),
+              evt.get("ivs_last_rois", "?"))
+
+
+def _log_default(evt, cam, ts_ms) -> None:
+    _log.info(_FMT_EVENT, cam, ts_ms, evt.get("type", "unknown"))
+
+
+# /event type -> logger; anything else goes to _log_default.
+_EVENT_LOGGERS = {"meteor": _log_meteor, "stack": _log_stack}
+
+
+def _json_response(obj, status: int = 200) -> Response:
+    """orjson-encoded JSON response, bypassing jsonify()."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+# Fixed bodies are built once and shared by every request; nothing downstream
+# (no after_request hooks, no session) mutates them.
+_OK           = _json_response({"status": "ok"})
+_BAD_FILENAME = _json_response({"status": "error", "msg": "bad filename"}, 400)
+
+
 def make_app(cfg: dict) -> Flask:
     """Make app"""
     # pylint: disable=too-many-statements
     app = Flask(__name__)
+    # A Content-Length over the limit gets a 413 before anything is written
+    # or preallocated; the savers enforce the exact limit on what arrives.
+    # Werkzeug's stream raises on the first read past MAX_CONTENT_LENGTH,
+    # which for a body of exactly max_upload bytes is the read that would
+    # see EOF, so it gets one byte of slack.  null means no limit.
+    max_upload = cfg.get("max_upload_bytes", DEFAULT_CONFIG["max_upload_bytes"])
+    if max_upload is not None:
+        max_upload = int(max_upload)
+        if max_upload <= 0:
+            raise ValueError("max_upload_bytes must be positive (or null for no limit)")
+        app.config["MAX_CONTENT_LENGTH"] = max_upload + 1
+
+    def _request_body():
+        # A server that terminates the body itself (gunicorn sets
+        # wsgi.input_terminated) lets us read its stream directly: it only
+        # has read(), so save_stream gathers the chunks with writev instead
+        # of going through werkzeug's LimitedStream.readinto copies.  The
+        # savers enforce max_upload on it.
+        environ = request.environ
+        if "wsgi.input_terminated" not in environ:
+            return request.stream
+        if max_upload is not None and (request.content_length or 0) > max_upload:
+            raise RequestEntityTooLarge()
+        return environ["wsgi.input"]
 
     captured_root = os.path.join(cfg["rms_data_dir"], cfg["captured_subdir"])
     stack_root    = os.path.join(cfg["rms_data_dir"], cfg["stack_subdir"])
@@ -166,52 +581,189 @@ def make_app(cfg: dict) -> Flask:
     ensure_dir(stack_root)
     if cfg.get("save_raw_stack", True):
         ensure_dir(raw_stack_root)
+    durable = bool(cfg.get("durable_writes", False))
+    # Split and validate the RMS command once, at startup.
+    rms_cmd = None
+    if cfg.get("rms_run_on_receive"):
+        rms_cmd = rms_argv(cfg.get("rms_detect_script",
+                                   DEFAULT_CONFIG["rms_detect_script"]))
+
+    # Night directory caches, one per root: {night_start_epoch: {station: path}}.
+    # Only a path's first use costs a makedirs; two nights are kept so requests
+    # straddling the 12:00 UTC rollover never thrash.  Entries come only from
+    # real requests; directories made ahead of the rollover live in a separate
+    # per-root "upcoming" map ({night_start_epoch: {station: path}}) until a
+    # request for that night claims them.
+    ff_night_cache = {}
+    stack_night_cache = {}
+    raw_night_cache = {}
+    ff_upcoming = {}
+    stack_upcoming = {}
+    raw_upcoming = {}
+
+    def _make_night_dir(path: str) -> None:
+        ensure_dir(path)
+        if durable:
+            # Persist the new night and station entries, not just the files.
+            sync_dir(os.path.dirname(path))
+            sync_dir(os.path.dirname(os.path.dirname(path)))
+
+    def _night_dir(cache: dict, upcoming: dict, root: str, station: str,
+                   now: int) -> str:
+        key = night_start_epoch(now)
+        paths = cache.get(key)
+        if paths is None:
+            for old in sorted(cache)[:-1]:
+                cache.pop(old, None)
+            paths = cache.setdefault(key, {})
+        path = paths.get(station)
+        if path is None:
+            path = upcoming.get(key, _EMPTY).get(station)
+            if path is None:
+                path = os.path.join(root, station, night_dir_name_fast(now))
+                _make_night_dir(path)
+            paths[station] = path
+        return path
+
+    night_roots = ((ff_night_cache, ff_upcoming, captured_root),
+                   (stack_night_cache, stack_upcoming, stack_root),
+                   (raw_night_cache, raw_upcoming, raw_stack_root))
+
+    def _precreate_next_night() -> None:
+        """Create the coming night's dirs for stations that reported tonight."""
+        try:
+            now = int(time.time())
+            tonight = night_start_epoch(now)
+            key = night_start_epoch(now + PRECREATE_LEAD_S)
+            if key == tonight:
+                return   # fired early; _schedule_precreate re-arms shortly
+            for cache, upcoming, root in night_roots:
+                made = {}
+                for station in list(cache.get(tonight, _EMPTY)):
+                    path = os.path.join(root, station, night_dir_name_fast(key))
+                    try:
+                        _make_night_dir(path)
+                    except OSError as exc:
+                        logging.warning("pre-create %s failed: %s", path, exc)
+                        continue
+                    made[station] = path
+                upcoming.clear()
+                if made:
+                    upcoming[key] = made
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception("night directory pre-create failed")
+        finally:
+            _schedule_precreate()
+
+    def _schedule_precreate() -> None:
+        now = time.time()
+        fire_at = night_start_epoch(int(now)) + 86400 - PRECREATE_LEAD_S
+        if fire_at <= now:
+            fire_at += 86400
+        timer = threading.Timer(fire_at - now, _precreate_next_night)
+        timer.daemon = True
+        timer.start()
+
+    # RMS runs are handed to RMS_TRIGGER_WORKERS daemon threads so /ff never
+    # waits on fork+exec.  Daemon threads do not hold up worker shutdown:
+    # runs still queued are dropped, and a running RMS (in its own session)
+    # carries on without us.  The worker threads and bookkeeping are per
+    # process, so up to RMS_TRIGGER_WORKERS * $WEB_CONCURRENCY runs can be
+    # active.  Within a process, FFs arriving while a night is queued are
+    # covered by that run, and FFs arriving while it is running earn exactly
+    # one follow-up run; across processes, _trigger_rms's lock file makes
+    # runs on the same night wait for each other.
+    rms_queue = queue.SimpleQueue()
+    rms_state = {}   # night_dir -> "queued" | "running" | "rerun"
+    rms_lock = threading.Lock()
+
+    def _rms_worker() -> None:
+        while True:
+            night_dir = rms_queue.get()
+            try:
+                _run_rms(night_dir)
+            except Exception:  # pylint: disable=broad-except,broad-exception-caught
+                logging.exception("RMS trigger crashed")
+
+    def _start_rms_workers() -> None:
+        for i in range(RMS_TRIGGER_WORKERS):
+            threading.Thread(target=_rms_worker, name=f"rms-{i}", daemon=True).start()
+
+    def _submit_rms(night_dir: str) -> None:
+        rms_queue.put(night_dir)
+
+    def _run_rms(night_dir: str) -> None:
+        with rms_lock:
+            rms_state[night_dir] = "running"
+        try:
+            _trigger_rms(rms_cmd, night_dir)
+        finally:
+            with rms_lock:
+                rerun = rms_state.get(night_dir) == "rerun"
+                if rerun:
+                    rms_state[night_dir] = "queued"
+                else:
+                    rms_state.pop(night_dir, None)
+            if rerun:
+                _submit_rms(night_dir)
+
+    def _queue_rms(night_dir: str) -> None:
+        with rms_lock:
+            state = rms_state.get(night_dir)
+            if state == "running":
+                rms_state[night_dir] = "rerun"
+            if state is not None:
+                return
+            rms_state[night_dir] = "queued"
+        _submit_rms(night_dir)
+
+    # Background threads (log listener, precreate timer, RMS workers) are
+    # started by the first request a process serves, never in a --preload master that is
+    # about to fork workers.
+    arm_lock = threading.Lock()
+    armed = []
+
+    @app.before_request
+    def _arm_background_work():
+        if armed:
+            return
+        with arm_lock:
+            if not armed:
+                start_log_queue()
+                _schedule_precreate()
+                if rms_cmd is not None:
+                    _start_rms_workers()
+                armed.append(True)
 
     # -----------------------------------------------------------------------
     # GET /time — return current UTC Unix timestamp for camera clock sync
     # -----------------------------------------------------------------------
     @app.route("/time", methods=["GET"])
     def get_time():
-        return jsonify({"unix": time.time()})
+        return _json_response({"unix": time.time()})
 
     # -----------------------------------------------------------------------
     # POST /event — receive a JSON detection event
     # -----------------------------------------------------------------------
     @app.route("/event", methods=["POST"])
     def recv_event():
+        # Events are only logged, so skip parsing entirely below INFO.
+        if not _log.isEnabledFor(logging.INFO):
+            return _OK
+
         try:
-            evt = request.get_json(force=True, silent=True) or {}
-        except Exception:  # pylint: disable=broad-exception-caught
-            evt = {}
-
-        ts_ms    = evt.get("timestamp_ms", int(time.time() * 1000))
-        cam      = evt.get("camera_id", "unknown")
-        evt_type = evt.get("type", "unknown")
-
-        if evt_type == "meteor":
-            cand = evt.get("candidate", {})
-            logging.info(
-                "METEOR cam=%s ts_ms=%d rho=%s theta=%s votes=%s len=%s",
-                cam, ts_ms,
-                cand.get("rho", "?"), cand.get("theta", "?"),
-                cand.get("votes", "?"), cand.get("length_px", "?"),
-            )
-        elif evt_type == "stack":
-            logging.info(
-                "STACK  cam=%s ts_ms=%d file=%s "
-                "ivs_polls=%s active=%s total_rois=%s last=%s",
-                cam, ts_ms,
-                evt.get("filename", "?"),
-                evt.get("ivs_polls", "?"),
-                evt.get("ivs_active_polls", "?"),
-                evt.get("ivs_total_rois", "?"),
-                evt.get("ivs_last_rois", "?"),
-            )
-        else:
-            logging.info("EVENT  cam=%s ts_ms=%d type=%s",
-                         cam, ts_ms, evt_type)
+            evt = orjson.loads(request.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            evt = _EMPTY
+        if not isinstance(evt, dict):
+            evt = _EMPTY
+
+        ts_ms = evt.get("timestamp_ms", int(time.time() * 1000))
+        cam   = evt.get("camera_id", "unknown")
+        # str() keeps non-string (possibly unhashable) JSON types out of the lookup.
+        _EVENT_LOGGERS.get(str(evt.get("type")), _log_default)(evt, cam, ts_ms)
 
-        return jsonify({"status": "ok"}), 200
+        return _OK
 
     # -----------------------------------------------------------------------
     # OpenSky Network Lookup (Background Worker)
@@ -306,29 +858,34 @@ def make_app(cfg: dict) -> Flask:
     @app.route("/ff", methods=["POST"])
     def recv_ff():
         filename = request.headers.get("X-Filename", "")
-        if not filename or "/" in filename or "\\" in filename:
+        if not _SAFE_FILENAME(filename):
             logging.warning("recv_ff: missing or unsafe X-Filename header")
-            return jsonify({"status": "error", "msg": "bad filename"}), 400
+            return _BAD_FILENAME
 
-        now        = datetime.now(tz=timezone.utc)
+        now        = int(time.time())
         station    = station_from_filename(filename)
-        night_dir  = os.path.join(captured_root, station, night_dir_name(now))
-        ensure_dir(night_dir)
+        night_dir  = _night_dir(ff_night_cache, ff_upcoming, captured_root,
+                                station, now)
         dest_path  = os.path.join(night_dir, filename)
 
-        data = request.get_data()
-        with open(dest_path, "wb") as fh:
-            fh.write(data)
+        size_hint = request.content_length
+        if size_hint and max_upload is not None:
+            size_hint = min(size_hint, max_upload)
+        saver = save_stream_direct if cfg.get("direct_io") else save_stream
+        total = with_dir(dest_path, _make_night_dir, saver, _request_body(),
+                         dest_path, durable,
+                         cfg.get("drop_cache_after_write", False),
+                         size_hint, max_upload)
 
-        logging.info("FF saved: %s (%d bytes)", dest_path, len(data))
+        logging.info("FF saved: %s (%d bytes)", dest_path, total)
 
-        if cfg.get("rms_run_on_receive"):
-            _trigger_rms(cfg, night_dir)
+        if rms_cmd is not None:
+            _queue_rms(night_dir)
 
         if cfg.get("address") is not None:
             threading.Thread(target=_query_opensky_bg, args=(dest_path, cfg), daemon=True).start()
 
-        return jsonify({"status": "ok", "path": dest_path}), 200
+        return _json_response({"status": "ok", "path": dest_path})
 
     # -----------------------------------------------------------------------
     # POST /stack — receive a timelapse stack JPEG from nightcam
@@ -336,37 +893,46 @@ def make_app(cfg: dict) -> Flask:
     @app.route("/stack", methods=["POST"])
     def recv_stack():
         filename = request.headers.get("X-Filename", "")
-        if not filename or "/" in filename or "\\" in filename:
+        if not _SAFE_FILENAME(filename):
             logging.warning("recv_stack: missing or unsafe X-Filename header")
-            return jsonify({"status": "error", "msg": "bad filename"}), 400
+            return _BAD_FILENAME
 
-        now       = datetime.now(tz=timezone.utc)
+        now       = int(time.time())
         station   = station_from_filename(filename)
-        night_dir = os.path.join(stack_root, station, night_dir_name(now))
-        ensure_dir(night_dir)
+        night_dir = _night_dir(stack_night_cache, stack_upcoming, stack_root,
+                               station, now)
         dest_path = os.path.join(night_dir, filename)
 
-        data = request.get_data()
-
+        # Stream the body straight to disk: into the raw copy when one is kept,
+        # otherwise directly into the final destination.
+        src_path = dest_path
         if cfg.get("save_raw_stack", True):
-            raw_night_dir = os.path.join(raw_stack_root, station, night_dir_name(now))
-            ensure_dir(raw_night_dir)
-            raw_dest_path = os.path.join(raw_night_dir, filename)
-            with open(raw_dest_path, "wb") as fh:
-                fh.write(data)
-            logging.info("RAW STACK saved: %s (%d bytes)", raw_dest_path, len(data))
+            raw_night_dir = _night_dir(raw_night_cache, raw_upcoming, raw_stack_root,
+                                       station, now)
+            src_path = os.path.join(raw_night_dir, filename)
+        total = with_dir(src_path, _make_night_dir, save_stream,
+                         _request_body(), src_path, durable,
+                         limit=max_upload)
+        if src_path != dest_path:
+            logging.info("RAW STACK saved: %s (%d bytes)", src_path, total)
 
         if cfg.get("stack_enhance", True):
+            # Enhancement needs the whole image in memory anyway.
+            with open(src_path, "rb") as fh:
+                data = fh.read()
             try:
                 data = _enhance_stack(data, quality=cfg.get("stack_jpeg_quality", 92))
             except Exception as exc:  # pylint: disable=broad-except,broad-exception-caught
                 logging.warning("stack enhance failed, saving raw: %s", exc)
+            with_dir(dest_path, _make_night_dir, write_file,
+                     dest_path, data, durable)
+            total = len(data)
+        elif src_path != dest_path:
+            with_dir(dest_path, _make_night_dir, copy_file,
+                     src_path, dest_path, durable)
 
-        with open(dest_path, "wb") as fh:
-            fh.write(data)
-
-        logging.info("STACK saved: %s (%d bytes)", dest_path, len(data))
-        return jsonify({"status": "ok", "path": dest_path}), 200
+        logging.info("STACK saved: %s (%d bytes)", dest_path, total)
+        return _json_response({"status": "ok", "path": dest_path})
 
     return app
 
@@ -375,20 +941,108 @@ def make_app(cfg: dict) -> Flask:
 # RMS trigger (optional, called after each FF file)
 # ---------------------------------------------------------------------------
 
-def _trigger_rms(cfg: dict, night_dir: str) -> None:
-    cmd = f"{cfg['rms_detect_script']} {night_dir}"
-    logging.info("Triggering RMS: %s", cmd)
+def rms_argv(script) -> list:
+    """
+    Turn rms_detect_script (a command string or a YAML list) into an argv
+    list that can be exec'd without a shell.  Raises ValueError if empty.
+    """
+    if isinstance(script, str):
+        argv = shlex.split(script)
+    else:
+        argv = [str(arg) for arg in script or ()]
+    if not argv:
+        raise ValueError("rms_detect_script is empty")
+    return argv
+
+
+def _trigger_rms(rms_cmd: list, night_dir: str) -> None:
+    argv = [*rms_cmd, night_dir]
+    try:
+        lock_fd = os.open(os.path.join(night_dir, RMS_LOCK_NAME),
+                          os.O_WRONLY | os.O_CREAT, 0o644)
+    except OSError as exc:
+        logging.warning("RMS trigger failed: %s", exc)
+        return
     try:
-        with subprocess.Popen(cmd, shell=True) as _:  # noqa: S602
+        # Wait out a run on this night started by another gunicorn worker.
+        # The child inherits the lock, so it stays held until RMS exits even
+        # if this worker goes away first.
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        logging.info("Triggering RMS: %s", shlex.join(argv))
+        # No shell, and no other inherited fds (e.g. the listening socket).
+        with subprocess.Popen(argv, close_fds=True, pass_fds=(lock_fd,),
+                              start_new_session=True,
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL) as _:
             pass
     except OSError as exc:
         logging.warning("RMS trigger failed: %s", exc)
+    finally:
+        os.close(lock_fd)
 
 
 # ---------------------------------------------------------------------------
 # Entry point
 # ---------------------------------------------------------------------------
 
+_log_handler  = None   # stderr handler installed by setup_logging()
+_log_listener = None   # QueueListener feeding _log_handler, once started
+
+
+def setup_logging(cfg: dict) -> None:
+    """
+    Configure root logging from cfg["log_level"].  Records are written
+    synchronously until start_log_queue() moves the writes to a listener
+    thread; that is left to the process that serves requests, so a
+    --preload gunicorn master never forks with a logging thread running.
+    """
+    global _log_handler  # pylint: disable=global-statement
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, cfg["log_level"].upper(), logging.INFO))
+    root.handlers = [_log_handler]
+    atexit.register(stop_logging)
+
+
+def start_log_queue() -> None:
+    """
+    Route root logging through a QueueHandler.  Request threads then only
+    put records on a queue (QueueHandler still merges the %-args there); a
+    QueueListener thread applies the timestamp/level format and does the
+    stream write, so the handler lock and the I/O are off the request path.
+    """
+    global _log_listener  # pylint: disable=global-statement
+    if _log_handler is None or _log_listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, _log_handler)
+    _log_listener.start()
+    logging.getLogger().handlers = [logging.handlers.QueueHandler(log_queue)]
+
+
+def stop_logging() -> None:
+    """Flush queued log records, stop the listener and log synchronously again."""
+    global _log_listener  # pylint: disable=global-statement
+    if _log_listener is not None:
+        logging.getLogger().handlers = [_log_handler]
+        _log_listener.stop()
+        _log_listener = None
+
+
+def make_app_from_env() -> Flask:
+    """
+    gunicorn entry point: load the config named by $RECEIVER_CONFIG
+    (default config.yaml) and build the app.  With --preload this runs once
+    in the master, so workers share the config and app pages after fork.
+    """
+    cfg = load_config(os.environ.get("RECEIVER_CONFIG", "config.yaml"))
+    setup_logging(cfg)
+    return make_app(cfg)
+
+
 def main() -> None:
     """Main"""
     parser = argparse.ArgumentParser(description="Meteor FF receiver")
@@ -397,17 +1051,28 @@ def main() -> None:
     args = parser.parse_args()
 
     cfg = load_config(args.config)
-
-    logging.basicConfig(
-        level=getattr(logging, cfg["log_level"].upper(), logging.INFO),
-        format="%(asctime)s %(levelname)s %(message)s",
-    )
-
-    app = make_app(cfg)
+    setup_logging(cfg)
+
+    # Serve with gunicorn gthread workers rather than the Werkzeug dev server
+    # so concurrent uploads (disk writes, RMS triggers) run in parallel.
+    os.environ["RECEIVER_CONFIG"] = os.path.abspath(args.config)
+    # Run gunicorn with this interpreter so an unactivated venv still works.
+    argv = [
+        sys.executable, "-m", "gunicorn",
+        "--chdir", os.path.dirname(os.path.abspath(__file__)),
+        "-k", "gthread",
+        "--threads", "5",
+        "--workers", os.environ.get("WEB_CONCURRENCY", "2"),
+        "--preload",
+        "-b", f"{cfg['listen_host']}:{int(cfg['listen_port'])}",
+        "receiver:make_app_from_env()",
+    ]
     logging.info("Starting receiver on %s:%s",
                  cfg["listen_host"], cfg["listen_port"])
-    app.run(host=cfg["listen_host"], port=int(cfg["listen_port"]),
-            threaded=True)
+    try:
+        os.execvp(argv[0], argv)
+    except OSError as exc:
+        sys.exit(f"could not exec gunicorn: {exc}")
 
 
 if __name__ == "__main__":